@@ -4,38 +4,315 @@ Step-sequencer heartbeat check. Invoked by heartbeat cycle or agent.
 Reads state.json, invokes runner when work exists. Does NOT execute work—invokes runner.
 """
 
+import functools
+import importlib.util
 import json
 import os
+import socket
+import stat
 import subprocess
 import sys
+import time
 from datetime import datetime, timezone
 from pathlib import Path
+from types import ModuleType
+
+try:
+    import orjson
+
+    _loads = orjson.loads
+
+    def _dumps(obj: dict) -> bytes:
+        return orjson.dumps(obj, option=orjson.OPT_INDENT_2)
+
+except ImportError:  # orjson is optional; stdlib json produces the same layout
+    _loads = json.loads
+
+    def _dumps(obj: dict) -> bytes:
+        return json.dumps(obj, indent=2).encode()
+
+
+_SCRIPTS_DIR = Path(__file__).resolve().parent
+_DEFAULT_RUNNER = _SCRIPTS_DIR / "step-sequencer-runner.py"
+_MAX_RETRIES_DEFAULT = 3
+
+# Runner modules loaded in-process, keyed by resolved path
+_RUNNER_MODULES: dict[Path, ModuleType] = {}
+
+_HEARTBEAT_KEY = "lastHeartbeatIso"
+
+
+def _heartbeat_path(state_path: Path) -> Path:
+    """Sidecar holding lastHeartbeatIso for heartbeats that change nothing else."""
+    return state_path.with_suffix(".heartbeat")
+
+
+# (epoch second, ISO string) of the last timestamp produced by _now_iso
+_ISO_CACHE: list = [0, ""]
+
+
+def _now_iso() -> str:
+    """Current UTC time as ISO 8601, to the second. Reuses the string within the same second."""
+    sec = int(time.time())
+    if _ISO_CACHE[0] == sec:
+        return _ISO_CACHE[1]
+    iso = datetime.fromtimestamp(sec, timezone.utc).isoformat()
+    _ISO_CACHE[:] = [sec, iso]
+    return iso
+
+
+# Directories already known to exist, so saves skip mkdir
+_KNOWN_DIRS: set[Path] = set()
+
+
+def _write_atomic(path: Path, data: bytes) -> None:
+    """
+    Write data to a temp file in the same directory, then os.replace over path so
+    readers never see a torn file. An existing file's mode is kept. fsync only when
+    STEP_FSYNC=1. A symlinked path is followed, so the link's target is updated.
+    """
+    path = Path(os.path.realpath(path))
+    parent = path.parent
+    if parent not in _KNOWN_DIRS:
+        parent.mkdir(parents=True, exist_ok=True)
+        _KNOWN_DIRS.add(parent)
+    try:
+        mode = stat.S_IMODE(path.stat().st_mode)
+    except FileNotFoundError:
+        mode = None
+    tmp = parent / f".{path.name}.{os.getpid()}.tmp"
+    fd = os.open(tmp, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o666)
+    try:
+        try:
+            if mode is not None:
+                os.fchmod(fd, mode)
+            view = memoryview(data)
+            while view:
+                view = view[os.write(fd, view):]
+            if os.environ.get("STEP_FSYNC") == "1":
+                os.fsync(fd)
+        finally:
+            os.close(fd)
+        os.replace(tmp, path)
+    except BaseException:
+        tmp.unlink(missing_ok=True)
+        raise
+
+
+def touch_heartbeat(state_path: Path, now: str) -> None:
+    """
+    Record a heartbeat in the sidecar without touching state.json. Skipped if the
+    sidecar was written less than STEP_HEARTBEAT_DEBOUNCE_SEC (default 30) ago.
+    """
+    hb_path = _heartbeat_path(state_path)
+    debounce = float(os.environ.get("STEP_HEARTBEAT_DEBOUNCE_SEC", "30"))
+    try:
+        if time.time() - hb_path.stat().st_mtime < debounce:
+            return
+    except FileNotFoundError:
+        pass
+    _write_atomic(hb_path, now.encode())
+
+
+# Read buffer reused across loads; doubled in place when a file does not fit
+_READ_BUF = bytearray(1 << 16)
+
+
+def _read_bytes(path: Path) -> bytes:
+    """Read a whole file with raw os.open/os.readv into _READ_BUF (no TextIOWrapper or buffering)."""
+    fd = os.open(path, os.O_RDONLY)
+    try:
+        n = 0
+        while True:
+            if n == len(_READ_BUF):
+                _READ_BUF.extend(bytes(len(_READ_BUF)))
+            got = os.readv(fd, [memoryview(_READ_BUF)[n:]])
+            if got == 0:
+                break
+            n += got
+    finally:
+        os.close(fd)
+    return bytes(memoryview(_READ_BUF)[:n])
 
 
 def load_state(state_path: Path) -> dict | None:
-    if not state_path.exists():
+    """Load state.json, with lastHeartbeatIso taken from the heartbeat sidecar if present."""
+    try:
+        state = _loads(_read_bytes(state_path))
+    except FileNotFoundError:
         return None
-    with open(state_path) as f:
-        return json.load(f)
+    try:
+        state[_HEARTBEAT_KEY] = _read_bytes(_heartbeat_path(state_path)).decode().strip()
+    except FileNotFoundError:
+        pass
+    return state
 
 
 def save_state(state_path: Path, state: dict) -> None:
-    state_path.parent.mkdir(parents=True, exist_ok=True)
-    with open(state_path, "w") as f:
-        json.dump(state, f, indent=2)
+    """Persist state. The heartbeat sidecar is dropped: state.json now holds the latest timestamp."""
+    _write_atomic(state_path, _dumps(state))
+    _heartbeat_path(state_path).unlink(missing_ok=True)
+
+
+@functools.lru_cache(maxsize=8)
+def _resolve_runner(scripts_dir: str, env_runner: str | None) -> tuple[Path, bool] | None:
+    """
+    (runner path, is the bundled runner) for (scripts_dir, STEP_RUNNER), or None if the
+    runner does not exist. Memoized: the answer is fixed for a process.
+    """
+    runner = Path(env_runner) if env_runner is not None else Path(scripts_dir) / _DEFAULT_RUNNER.name
+    if not runner.exists():
+        return None
+    return runner, runner.resolve() == _DEFAULT_RUNNER
+
+
+def get_runner_path(scripts_dir: Path) -> Path | None:
+    """Existing runner to invoke, or None."""
+    resolved = _resolve_runner(str(scripts_dir), os.environ.get("STEP_RUNNER"))
+    return resolved[0] if resolved else None
 
 
-def get_runner_path(scripts_dir: Path) -> Path:
-    return Path(os.environ.get("STEP_RUNNER", str(scripts_dir / "step-sequencer-runner.py")))
+def _load_runner_module(runner: Path) -> ModuleType:
+    """Import the bundled runner once per process."""
+    mod = _RUNNER_MODULES.get(runner)
+    if mod is None:
+        spec = importlib.util.spec_from_file_location("step_runner", runner)
+        mod = importlib.util.module_from_spec(spec)
+        spec.loader.exec_module(mod)
+        _RUNNER_MODULES[runner] = mod
+    return mod
+
+
+def _run_runner_in_process(runner: Path, state_path: Path) -> None:
+    """Call the bundled runner's main(state_path). Runner errors are reported, not raised."""
+    try:
+        _load_runner_module(runner).main(str(state_path))
+    except Exception as e:
+        print(f"Runner error: {e!r}", file=sys.stderr)
+
+
+def _ensure_runner_daemon(runner: Path, sock_path: Path) -> bool:
+    """Spawn a runner daemon if its socket is absent. Returns True once the socket is up."""
+    if sock_path.exists():
+        return True
+    subprocess.Popen(
+        [sys.executable, str(runner), "--daemon", str(sock_path)],
+        stdin=subprocess.DEVNULL,
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL,
+        start_new_session=True,
+    )
+    deadline = time.monotonic() + 0.2
+    while time.monotonic() < deadline:
+        if sock_path.exists():
+            return True
+        time.sleep(0.01)
+    return False
+
+
+def _invoke_runner_daemon(state_path: Path, runner: Path) -> bool:
+    """
+    Hand state_path to the runner daemon at <state dir>/.runner.sock and wait for it
+    to finish. Returns False unless the daemon replied (caller falls back).
+    """
+    sock_path = state_path.parent / ".runner.sock"
+    if not _ensure_runner_daemon(runner, sock_path):
+        return False
+    s = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        try:
+            s.connect(str(sock_path))
+            s.sendall(str(state_path).encode() + b"\n")
+        except ConnectionRefusedError:
+            sock_path.unlink(missing_ok=True)  # stale socket from a dead daemon
+            return False
+        except OSError:
+            return False
+        try:
+            # No reply byte: the daemon closed without running it (e.g. idle shutdown), so fall back
+            return s.recv(1) != b""
+        except OSError:
+            return False
+    finally:
+        s.close()
 
 
 def invoke_runner(state_path: Path, scripts_dir: Path) -> None:
-    runner = get_runner_path(scripts_dir)
-    if runner.exists():
-        subprocess.run(
-            [sys.executable, str(runner), str(state_path)],
-            cwd=state_path.parent,
-        )
+    """
+    Invoke runner for state_path. The bundled runner is imported and called in-process
+    via main(state_path), avoiding interpreter startup on every heartbeat; with
+    STEP_RUNNER_DAEMON=1 it is reused as a long-lived daemon over a Unix socket.
+    Custom STEP_RUNNER scripts always run as a subprocess: .py files under the
+    current interpreter, anything else executed directly.
+    """
+    resolved = _resolve_runner(str(scripts_dir), os.environ.get("STEP_RUNNER"))
+    if resolved is None:
+        return
+    runner, bundled = resolved
+    # state_path is absolute, so the runner does not need its cwd set; legacy runners can opt back in
+    needs_cwd = os.environ.get("STEP_RUNNER_NEEDS_CWD") == "1"
+    if bundled:
+        if os.environ.get("STEP_RUNNER_DAEMON") == "1":
+            if _invoke_runner_daemon(state_path, _DEFAULT_RUNNER):
+                return
+        if not needs_cwd:
+            _run_runner_in_process(_DEFAULT_RUNNER, state_path)
+            return
+        prev_cwd = os.getcwd()
+        os.chdir(state_path.parent)
+        try:
+            _run_runner_in_process(_DEFAULT_RUNNER, state_path)
+        finally:
+            os.chdir(prev_cwd)
+        return
+    kwargs = {"cwd": state_path.parent} if needs_cwd else {}
+    cmd = [sys.executable, str(runner)] if runner.suffix == ".py" else [str(runner)]
+    # close_fds=False lets CPython use posix_spawn instead of fork+exec. Safe here: fds
+    # Python opens are non-inheritable by default (PEP 446) and check holds none open.
+    subprocess.run(cmd + [str(state_path)], close_fds=False, **kwargs)
+
+
+def _finish(state_path: Path, state: dict, scripts_dir: Path, invoke: bool) -> int:
+    """
+    Persist state, then invoke the runner if requested. The save must complete first:
+    the runner reads state.json to pick its step and writes it back when done.
+    """
+    save_state(state_path, state)
+    if invoke:
+        invoke_runner(state_path, scripts_dir)
+    return 0
+
+
+def _handle_failed(state_path: Path, state: dict, step_id: str, step_info: dict, advanced: bool, now: str) -> int:
+    """FAILED → reset to PENDING and invoke runner, or add a blocker once max retries is reached."""
+    tries = step_info.get("tries", 0)
+    max_retries = int(os.environ.get("STEP_MAX_RETRIES") or _MAX_RETRIES_DEFAULT)
+    if tries >= max_retries:
+        state.setdefault("blockers", []).append(f"{step_id}: max retries ({tries}) exceeded")
+        return _finish(state_path, state, _SCRIPTS_DIR, invoke=False)
+    step_info["status"] = "PENDING"
+    step_info.setdefault("tries", 0)
+    step_info.setdefault("error", "unknown")
+    step_info.setdefault("lastRunIso", now)
+    return _finish(state_path, state, _SCRIPTS_DIR, invoke=True)
+
+
+def _handle_pending_or_in_progress(
+    state_path: Path, state: dict, step_id: str, step_info: dict, advanced: bool, now: str
+) -> int:
+    """PENDING or IN_PROGRESS → persist only if currentStep advanced, else just the heartbeat; invoke runner."""
+    if advanced:
+        return _finish(state_path, state, _SCRIPTS_DIR, invoke=True)
+    touch_heartbeat(state_path, now)
+    invoke_runner(state_path, _SCRIPTS_DIR)
+    return 0
+
+
+# Handlers keyed by current step status. DONE steps are skipped before dispatch;
+# anything else falls through to _handle_pending_or_in_progress.
+_STATUS_HANDLERS = {
+    "FAILED": _handle_failed,
+}
 
 
 def check(state_path: Path) -> int:
@@ -43,8 +320,8 @@ def check(state_path: Path) -> int:
     Run heartbeat check. Returns 0 on success.
     1. Read state.json
     2. If no state or status=DONE → do nothing
-    3. If step FAILED → bump tries, reset to PENDING, invoke runner
-    4. If step DONE → advance currentStep, invoke runner
+    3. Advance currentStep past all steps already DONE; none left → status=DONE
+    4. If step FAILED → bump tries, reset to PENDING, invoke runner
     5. If step PENDING or IN_PROGRESS → invoke runner
     6. Update lastHeartbeatIso
     """
@@ -52,61 +329,35 @@ def check(state_path: Path) -> int:
     if state is None:
         return 0
 
-    now = datetime.now(timezone.utc).isoformat()
+    now = _now_iso()
     state["lastHeartbeatIso"] = now
 
     status = state.get("status", "IN_PROGRESS")
     if status == "DONE":
-        save_state(state_path, state)
+        # Terminal: nothing to persist beyond a (debounced) heartbeat
+        touch_heartbeat(state_path, now)
         return 0
 
     step_queue = state.get("stepQueue", [])
     current_step = state.get("currentStep", 0)
     step_runs = state.get("stepRuns", {})
-    scripts_dir = Path(__file__).resolve().parent
 
-    if not step_queue:
-        state["status"] = "DONE"
-        save_state(state_path, state)
-        return 0
+    # Advance past every step already DONE in one pass (recovery can leave several)
+    first_step = current_step
+    while current_step < len(step_queue) and step_runs.get(step_queue[current_step], {}).get("status") == "DONE":
+        current_step += 1
+    advanced = current_step != first_step
+    if advanced:
+        state["currentStep"] = current_step
 
     if current_step >= len(step_queue):
         state["status"] = "DONE"
-        save_state(state_path, state)
-        return 0
+        return _finish(state_path, state, _SCRIPTS_DIR, invoke=False)
 
     step_id = step_queue[current_step]
     step_info = step_runs.get(step_id, {"status": "PENDING", "tries": 0})
-    step_status = step_info.get("status")
-
-    if step_status == "DONE":
-        state["currentStep"] = current_step + 1
-        save_state(state_path, state)
-        invoke_runner(state_path, scripts_dir)
-        return 0
-
-    if step_status == "FAILED":
-        tries = step_info.get("tries", 0)
-        max_retries = int(os.environ.get("STEP_MAX_RETRIES", "3"))
-        if tries >= max_retries:
-            state.setdefault("blockers", []).append(f"{step_id}: max retries ({tries}) exceeded")
-            save_state(state_path, state)
-            return 0
-        step_runs[step_id] = {
-            "status": "PENDING",
-            "tries": tries,
-            "error": step_info.get("error", "unknown"),
-            "lastRunIso": step_info.get("lastRunIso", now),
-        }
-        state["stepRuns"] = step_runs
-        save_state(state_path, state)
-        invoke_runner(state_path, scripts_dir)
-        return 0
-
-    # PENDING or IN_PROGRESS: invoke runner
-    save_state(state_path, state)
-    invoke_runner(state_path, scripts_dir)
-    return 0
+    handler = _STATUS_HANDLERS.get(step_info.get("status"), _handle_pending_or_in_progress)
+    return handler(state_path, state, step_id, step_info, advanced, now)
 
 
 def main() -> int:
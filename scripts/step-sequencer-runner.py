@@ -8,6 +8,7 @@ On FAILED: invokes check script immediately for retry.
 import json
 import os
 import shutil
+import socketserver
 import subprocess
 import sys
 import time
@@ -28,6 +29,8 @@ def save_state(state_path: Path, state: dict) -> None:
         json.dump(state, f, indent=2)
 
 
+_SCRIPTS_DIR = Path(__file__).resolve().parent
+
 # Blocked to prevent command injection: instruction is appended and must not be executed by a shell
 _BLOCKED_BASES = frozenset({"bash", "sh", "dash", "zsh", "ksh", "eval", "exec"})
 _BLOCKED_ARGS = frozenset({"-c", "-e"})
@@ -114,7 +117,7 @@ def run(state_path: Path) -> int:
     current_step = state.get("currentStep", 0)
     step_runs = state.get("stepRuns", {})
     step_delay = state.get("stepDelayMinutes", 0)
-    scripts_dir = Path(__file__).resolve().parent
+    scripts_dir = _SCRIPTS_DIR
 
     if not step_queue or current_step >= len(step_queue):
         return 0
@@ -155,6 +158,7 @@ def run(state_path: Path) -> int:
     try:
         result = subprocess.run(
             agent_cmd,
+            cwd=state_path.parent,
             capture_output=True,
             text=True,
             timeout=3600,
@@ -200,9 +204,64 @@ def run(state_path: Path) -> int:
     return 0
 
 
-def main() -> int:
+class _RunRequestHandler(socketserver.StreamRequestHandler):
+    """One request per connection: state path + newline in, one exit-code byte out."""
+
+    def handle(self) -> None:
+        line = self.rfile.readline().decode().strip()
+        # Only serve state files next to the socket: the daemon runs the agent with its owner's env
+        if line and Path(line).is_absolute() and Path(line).parent == self.server.state_dir:
+            rc = main(line)
+        else:
+            rc = 2
+        self.wfile.write(bytes([rc & 0xFF]))
+
+
+class _RunnerServer(socketserver.ThreadingUnixStreamServer):
+    idle = False
+    state_dir: Path
+
+    def handle_timeout(self) -> None:
+        self.idle = True
+
+
+def serve(sock_path: Path) -> int:
+    """
+    Daemon mode (--daemon SOCK). Serve run requests from the check script on a Unix
+    socket until no request arrives for STEP_RUNNER_DAEMON_IDLE_SEC (default 600).
+    Each request runs in its own thread, so the check script invoked by a running
+    step can hand the next step back to this daemon.
+    """
+    idle_timeout = float(os.environ.get("STEP_RUNNER_DAEMON_IDLE_SEC", "600"))
+    # Listen on a temp path and rename into place: a socket file at sock_path is always live
+    tmp_path = sock_path.with_name(f"{sock_path.name}.{os.getpid()}")
+    tmp_path.unlink(missing_ok=True)
+    with _RunnerServer(str(tmp_path), _RunRequestHandler) as server:
+        server.timeout = idle_timeout
+        server.state_dir = sock_path.parent
+        os.chmod(tmp_path, 0o600)
+        os.replace(tmp_path, sock_path)
+        ino = sock_path.stat().st_ino
+        try:
+            while not server.idle:
+                server.handle_request()
+        finally:
+            try:
+                if sock_path.stat().st_ino == ino:
+                    sock_path.unlink()
+            except FileNotFoundError:
+                pass
+    return 0
+
+
+def main(state_path: str | None = None) -> int:
+    """Entry point. state_path defaults to argv[1]; check script passes it when calling in-process."""
+    if state_path is None and len(sys.argv) > 2 and sys.argv[1] == "--daemon":
+        return serve(Path(sys.argv[2]))
     try:
-        state_path = Path(sys.argv[1]) if len(sys.argv) > 1 else Path("state.json")
+        if state_path is None:
+            state_path = sys.argv[1] if len(sys.argv) > 1 else "state.json"
+        state_path = Path(state_path)
         if not state_path.is_absolute():
             state_path = Path.cwd() / state_path
         return run(state_path)
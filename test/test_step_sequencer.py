@@ -4,11 +4,16 @@ Automated tests for agent-step-sequencer check and runner.
 Uses echo/false as agent commands for deterministic behavior.
 """
 
+import atexit
 import json
 import os
+import shutil
+import socket
 import subprocess
 import sys
 import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
 from pathlib import Path
 
 # Add scripts to path
@@ -16,15 +21,101 @@ SCRIPTS_DIR = Path(__file__).resolve().parent.parent / "scripts"
 CHECK = SCRIPTS_DIR / "step-sequencer-check.py"
 RUNNER = SCRIPTS_DIR / "step-sequencer-runner.py"
 
+# Copied once; tests build their env as {**_BASE_ENV, ...} instead of copying os.environ
+_BASE_ENV = os.environ.copy()
 
-def run_check(state_path: Path, env: dict | None = None) -> subprocess.CompletedProcess:
-    env = env or os.environ.copy()
+
+def _serialize(state: dict) -> bytes:
+    return json.dumps(state, indent=2).encode()
+
+
+# State shapes shared by several tests, serialized once
+_TWO_STEP_STATE = _serialize({
+    "plan": {
+        "steps": {
+            "step-1": {"title": "First", "instruction": "one"},
+            "step-2": {"title": "Second", "instruction": "two"},
+        }
+    },
+    "stepQueue": ["step-1", "step-2"],
+    "currentStep": 0,
+    "stepRuns": {},
+    "stepDelayMinutes": 0,
+    "status": "IN_PROGRESS",
+})
+_FAIL_STEP_STATE = _serialize({
+    "plan": {"steps": {"step-1": {"title": "Fail", "instruction": "x"}}},
+    "stepQueue": ["step-1"],
+    "currentStep": 0,
+    "stepRuns": {},
+    "stepDelayMinutes": 0,
+    "status": "IN_PROGRESS",
+})
+_HELLO_STEP_STATE = _serialize({
+    "plan": {"steps": {"step-1": {"title": "X", "instruction": "hello"}}},
+    "stepQueue": ["step-1"],
+    "currentStep": 0,
+    "stepRuns": {},
+    "stepDelayMinutes": 0,
+    "status": "IN_PROGRESS",
+})
+_DONE_STATE = _serialize({
+    "plan": {"steps": {}},
+    "stepQueue": [],
+    "currentStep": 0,
+    "stepRuns": {},
+    "status": "DONE",
+})
+
+
+def _tmp_root() -> str | None:
+    """/dev/shm when writable so test I/O stays in RAM; None (system default) otherwise."""
+    shm = "/dev/shm"
+    return shm if os.path.isdir(shm) and os.access(shm, os.W_OK) else None
+
+
+# Temp root shared by all tests in this run; created on first use, or handed to pool workers by main
+_SHARED_TMP: Path | None = None
+
+
+def _shared_tmp() -> Path:
+    """Temp root shared by all tests in this run, removed at exit by the process that created it."""
+    global _SHARED_TMP
+    if _SHARED_TMP is None:
+        root = tempfile.mkdtemp(prefix="stepseq_tests_", dir=_tmp_root())
+        atexit.register(shutil.rmtree, root, ignore_errors=True)
+        _SHARED_TMP = Path(root)
+    return _SHARED_TMP
+
+
+def _init_worker(root: str) -> None:
+    """Pool worker initializer: reuse the parent's temp root instead of creating one."""
+    global _SHARED_TMP
+    _SHARED_TMP = Path(root)
+
+
+def _test_dir(name: str) -> Path:
+    """Fresh per-test directory under the shared root (requiredOutputs resolve against it)."""
+    path = _shared_tmp() / name
+    shutil.rmtree(path, ignore_errors=True)
+    path.mkdir(parents=True)
+    return path
+
+
+def _output_kwargs(capture: bool) -> dict:
+    """Capture output only when asked (or STEP_CAPTURE is set); otherwise discard it."""
+    if capture or os.environ.get("STEP_CAPTURE"):
+        return {"capture_output": True, "text": True}
+    return {"stdout": subprocess.DEVNULL, "stderr": subprocess.DEVNULL}
+
+
+def run_check(state_path: Path, env: dict | None = None, capture: bool = False) -> subprocess.CompletedProcess:
+    env = env if env is not None else _BASE_ENV
     return subprocess.run(
         [sys.executable, str(CHECK), str(state_path)],
         cwd=state_path.parent,
         env=env,
-        capture_output=True,
-        text=True,
+        **_output_kwargs(capture),
     )
 
 
@@ -35,361 +126,479 @@ def load_state(state_path: Path) -> dict:
 
 def test_basic_flow_two_steps():
     """Check invokes runner; with auto-advance, one run_check can complete both steps."""
-    with tempfile.TemporaryDirectory() as tmp:
-        state_path = Path(tmp) / "state.json"
-        state = {
-            "plan": {
-                "steps": {
-                    "step-1": {"title": "First", "instruction": "one"},
-                    "step-2": {"title": "Second", "instruction": "two"},
-                }
-            },
-            "stepQueue": ["step-1", "step-2"],
-            "currentStep": 0,
-            "stepRuns": {},
-            "stepDelayMinutes": 0,
-            "status": "IN_PROGRESS",
-        }
-        with open(state_path, "w") as f:
-            json.dump(state, f, indent=2)
+    tmp = _test_dir("test_basic_flow_two_steps")
+    state_path = tmp / "state.json"
+    state_path.write_bytes(_TWO_STEP_STATE)
+
+    env = {**_BASE_ENV, "STEP_AGENT_CMD": "echo"}
+
+    # Run 1: runner does step 1 -> DONE -> check advances -> runner step 2 -> DONE -> check advances
+    # past the last step and sets status DONE in the same pass
+    run_check(state_path, env)
+    s = load_state(state_path)
+    assert s["stepRuns"]["step-1"]["status"] == "DONE"
+    assert s["stepRuns"]["step-2"]["status"] == "DONE"
+    assert s["currentStep"] == 2
+    assert s["status"] == "DONE"
+
+    # Run 2: status already DONE -> check does nothing
+    run_check(state_path, env)
+    s = load_state(state_path)
+    assert s["status"] == "DONE"
 
-        env = os.environ.copy()
-        env["STEP_AGENT_CMD"] = "echo"
-
-        # Run 1: runner does step 1 -> DONE -> invokes check -> advance -> runner step 2 -> DONE -> check -> advance
-        run_check(state_path, env)
-        s = load_state(state_path)
-        assert s["stepRuns"]["step-1"]["status"] == "DONE"
-        assert s["stepRuns"]["step-2"]["status"] == "DONE"
-        assert s["currentStep"] == 2
+    print("test_basic_flow_two_steps: OK")
 
-        # Run 2: check sees currentStep >= len(stepQueue), sets status DONE
-        run_check(state_path, env)
-        s = load_state(state_path)
-        assert s["status"] == "DONE"
 
-    print("test_basic_flow_two_steps: OK")
+def test_runner_daemon_mode():
+    """STEP_RUNNER_DAEMON=1 -> check hands steps to a runner daemon; both steps complete."""
+    tmp = _test_dir("test_runner_daemon_mode")
+    state_path = tmp / "state.json"
+    state_path.write_bytes(_TWO_STEP_STATE)
+
+    env = {
+        **_BASE_ENV,
+        "STEP_AGENT_CMD": "echo",
+        "STEP_RUNNER_DAEMON": "1",
+        "STEP_RUNNER_DAEMON_IDLE_SEC": "2",
+    }
+
+    run_check(state_path, env)
+    # Only a live daemon leaves the socket behind; the in-process fallback never creates it
+    sock_path = tmp / ".runner.sock"
+    assert sock_path.is_socket()
+    assert sock_path.stat().st_mode & 0o777 == 0o600
+    # Requests for state files outside the socket's directory are refused (exit code 2)
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as client:
+        client.connect(str(sock_path))
+        client.sendall(str(_shared_tmp() / "elsewhere.json").encode() + b"\n")
+        assert client.recv(1) == b"\x02"
+    s = load_state(state_path)
+    assert s["stepRuns"]["step-1"]["status"] == "DONE"
+    assert s["stepRuns"]["step-2"]["status"] == "DONE"
+    assert s["currentStep"] == 2
+
+    # Daemon exits after the idle timeout and removes its socket
+    deadline = time.monotonic() + 10
+    while sock_path.exists() and time.monotonic() < deadline:
+        time.sleep(0.1)
+    assert not sock_path.exists()
+
+    print("test_runner_daemon_mode: OK")
+
+
+def test_custom_runner_runs_as_subprocess():
+    """Custom STEP_RUNNER: .py runner without main() runs exactly once; shell runner is executed directly."""
+    tmp = _test_dir("test_custom_runner_runs_as_subprocess")
+    state_path = tmp / "state.json"
+    state_path.write_bytes(_HELLO_STEP_STATE)
+    count = tmp / "count.txt"
+
+    py_runner = tmp / "runner.py"
+    py_runner.write_text(f"with open({str(count)!r}, 'a') as f:\n    f.write('py\\n')\n")
+    run_check(state_path, {**_BASE_ENV, "STEP_RUNNER": str(py_runner)})
+    assert count.read_text().splitlines() == ["py"]
+
+    sh_runner = tmp / "runner.sh"
+    sh_runner.write_text(f"#!/bin/sh\necho sh >> '{count}'\n")
+    sh_runner.chmod(0o755)
+    r = run_check(state_path, {**_BASE_ENV, "STEP_RUNNER": str(sh_runner)})
+    assert r.returncode == 0
+    assert count.read_text().splitlines() == ["py", "sh"]
+
+    print("test_custom_runner_runs_as_subprocess: OK")
 
 
 def test_failure_marks_failed():
     """Agent returns non-zero -> step marked FAILED, error stored."""
-    with tempfile.TemporaryDirectory() as tmp:
-        state_path = Path(tmp) / "state.json"
-        state = {
-            "plan": {"steps": {"step-1": {"title": "Fail", "instruction": "x"}}},
-            "stepQueue": ["step-1"],
-            "currentStep": 0,
-            "stepRuns": {},
-            "stepDelayMinutes": 0,
-            "status": "IN_PROGRESS",
-        }
-        with open(state_path, "w") as f:
-            json.dump(state, f, indent=2)
+    tmp = _test_dir("test_failure_marks_failed")
+    state_path = tmp / "state.json"
+    state_path.write_bytes(_FAIL_STEP_STATE)
 
-        env = os.environ.copy()
-        env["STEP_AGENT_CMD"] = "false"  # always fails
+    env = {**_BASE_ENV, "STEP_AGENT_CMD": "false"}  # always fails
 
-        run_check(state_path, env)
-        s = load_state(state_path)
-        assert s["stepRuns"]["step-1"]["status"] == "FAILED"
-        assert "error" in s["stepRuns"]["step-1"]
+    run_check(state_path, env)
+    s = load_state(state_path)
+    assert s["stepRuns"]["step-1"]["status"] == "FAILED"
+    assert "error" in s["stepRuns"]["step-1"]
 
     print("test_failure_marks_failed: OK")
 
 
 def test_retry_stops_at_max_retries():
     """On FAILED, retries until STEP_MAX_RETRIES, then adds to blockers."""
-    with tempfile.TemporaryDirectory() as tmp:
-        state_path = Path(tmp) / "state.json"
-        state = {
-            "plan": {"steps": {"step-1": {"title": "Fail", "instruction": "x"}}},
-            "stepQueue": ["step-1"],
-            "currentStep": 0,
-            "stepRuns": {},
-            "stepDelayMinutes": 0,
-            "status": "IN_PROGRESS",
-        }
-        with open(state_path, "w") as f:
-            json.dump(state, f, indent=2)
-
-        env = os.environ.copy()
-        env["STEP_AGENT_CMD"] = "false"
-        env["STEP_MAX_RETRIES"] = "2"
-
-        run_check(state_path, env)
-        s = load_state(state_path)
-        assert s["stepRuns"]["step-1"]["status"] == "FAILED"
-        assert s["stepRuns"]["step-1"]["tries"] >= 2
-        assert "blockers" in s
-        assert any("step-1" in b for b in s["blockers"])
+    tmp = _test_dir("test_retry_stops_at_max_retries")
+    state_path = tmp / "state.json"
+    state_path.write_bytes(_FAIL_STEP_STATE)
+
+    env = {
+        **_BASE_ENV,
+        "STEP_AGENT_CMD": "false",
+        "STEP_MAX_RETRIES": "2",
+    }
+
+    run_check(state_path, env)
+    s = load_state(state_path)
+    assert s["stepRuns"]["step-1"]["status"] == "FAILED"
+    assert s["stepRuns"]["step-1"]["tries"] >= 2
+    assert "blockers" in s
+    assert any("step-1" in b for b in s["blockers"])
 
     print("test_retry_stops_at_max_retries: OK")
 
 
 def test_recovery_mid_flow():
-    """State with step 1 DONE, step 2 PENDING -> one run_check advances and runs step 2."""
-    with tempfile.TemporaryDirectory() as tmp:
-        state_path = Path(tmp) / "state.json"
-        state = {
-            "plan": {
-                "steps": {
-                    "step-1": {"title": "Done", "instruction": "a"},
-                    "step-2": {"title": "Next", "instruction": "b"},
-                }
-            },
-            "stepQueue": ["step-1", "step-2"],
-            "currentStep": 0,
-            "stepRuns": {"step-1": {"status": "DONE", "tries": 1, "lastRunIso": "2025-01-01T00:00:00Z"}},
-            "stepDelayMinutes": 0,
-            "status": "IN_PROGRESS",
-        }
-        with open(state_path, "w") as f:
-            json.dump(state, f, indent=2)
-
-        env = os.environ.copy()
-        env["STEP_AGENT_CMD"] = "echo"
+    """State with step 1 DONE, step 2 PENDING -> one run_check advances, runs step 2 and marks state DONE."""
+    tmp = _test_dir("test_recovery_mid_flow")
+    state_path = tmp / "state.json"
+    state = {
+        "plan": {
+            "steps": {
+                "step-1": {"title": "Done", "instruction": "a"},
+                "step-2": {"title": "Next", "instruction": "b"},
+            }
+        },
+        "stepQueue": ["step-1", "step-2"],
+        "currentStep": 0,
+        "stepRuns": {"step-1": {"status": "DONE", "tries": 1, "lastRunIso": "2025-01-01T00:00:00Z"}},
+        "stepDelayMinutes": 0,
+        "status": "IN_PROGRESS",
+    }
+    state_path.write_bytes(_serialize(state))
+
+    env = {**_BASE_ENV, "STEP_AGENT_CMD": "echo"}
+
+    run_check(state_path, env)
+    s = load_state(state_path)
+    assert s["currentStep"] == 2
+    assert s["stepRuns"]["step-2"]["status"] == "DONE"
+    assert s["status"] == "DONE"
+
+    run_check(state_path, env)  # already DONE -> no-op
+    s = load_state(state_path)
+    assert s["status"] == "DONE"
 
-        run_check(state_path, env)
-        s = load_state(state_path)
-        assert s["currentStep"] == 2
-        assert s["stepRuns"]["step-2"]["status"] == "DONE"
+    print("test_recovery_mid_flow: OK")
 
-        run_check(state_path, env)  # set status DONE
-        s = load_state(state_path)
-        assert s["status"] == "DONE"
 
-    print("test_recovery_mid_flow: OK")
+def test_recovery_skips_consecutive_done_steps():
+    """Steps 1-2 DONE, step 3 PENDING -> one run_check skips both, runs step 3, marks state DONE."""
+    tmp = _test_dir("test_recovery_skips_consecutive_done_steps")
+    state_path = tmp / "state.json"
+    done = {"status": "DONE", "tries": 1, "lastRunIso": "2025-01-01T00:00:00Z"}
+    state = {
+        "plan": {
+            "steps": {
+                "step-1": {"title": "Done", "instruction": "a"},
+                "step-2": {"title": "Done", "instruction": "b"},
+                "step-3": {"title": "Next", "instruction": "c"},
+            }
+        },
+        "stepQueue": ["step-1", "step-2", "step-3"],
+        "currentStep": 0,
+        "stepRuns": {"step-1": dict(done), "step-2": dict(done)},
+        "stepDelayMinutes": 0,
+        "status": "IN_PROGRESS",
+    }
+    state_path.write_bytes(_serialize(state))
+
+    env = {**_BASE_ENV, "STEP_AGENT_CMD": "echo"}
+
+    run_check(state_path, env)
+    s = load_state(state_path)
+    assert s["stepRuns"]["step-1"]["tries"] == 1
+    assert s["stepRuns"]["step-2"]["tries"] == 1
+    assert s["stepRuns"]["step-3"]["status"] == "DONE"
+    assert s["currentStep"] == 3
+    assert s["status"] == "DONE"
+
+    print("test_recovery_skips_consecutive_done_steps: OK")
+
+
+def test_save_keeps_state_file_mode():
+    """Atomic save (temp file + rename) keeps a restrictive state.json mode."""
+    tmp = _test_dir("test_save_keeps_state_file_mode")
+    state_path = tmp / "state.json"
+    state_path.write_bytes(_FAIL_STEP_STATE)
+    state_path.chmod(0o600)
+
+    env = {**_BASE_ENV, "STEP_AGENT_CMD": "false", "STEP_MAX_RETRIES": "1"}
+    run_check(state_path, env)
+    s = load_state(state_path)
+    assert "blockers" in s
+    assert state_path.stat().st_mode & 0o777 == 0o600
+    assert not list(tmp.glob(".state.json.*.tmp"))
+
+    print("test_save_keeps_state_file_mode: OK")
+
+
+def test_save_follows_symlinked_state():
+    """state.json symlinked elsewhere -> saves update the target and keep the link."""
+    tmp = _test_dir("test_save_follows_symlinked_state")
+    (tmp / "data").mkdir()
+    target = tmp / "data" / "real.json"
+    target.write_bytes(_FAIL_STEP_STATE)
+    state_path = tmp / "state.json"
+    state_path.symlink_to(target)
+
+    env = {**_BASE_ENV, "STEP_AGENT_CMD": "false", "STEP_MAX_RETRIES": "1"}
+    run_check(state_path, env)
+    assert state_path.is_symlink()
+    s = load_state(target)
+    assert any("step-1" in b for b in s.get("blockers", []))
+
+    print("test_save_follows_symlinked_state: OK")
+
+
+def test_large_state_file_loads():
+    """state.json larger than the check's 64 KiB read buffer -> loaded intact, across repeated checks."""
+    tmp = _test_dir("test_large_state_file_loads")
+    state_path = tmp / "state.json"
+    artifacts = [f"artifacts/file-{i:06d}.md" for i in range(10000)]
+    state = {
+        "plan": {"steps": {}},
+        "stepQueue": [],
+        "currentStep": 0,
+        "stepRuns": {},
+        "artifacts": artifacts,
+        "status": "IN_PROGRESS",
+    }
+    state_path.write_bytes(_serialize(state))
+    assert state_path.stat().st_size > 1 << 16
+
+    run_check(state_path)  # empty queue -> loads, sets status DONE, saves
+    s = load_state(state_path)
+    assert s["status"] == "DONE"
+    assert s["artifacts"] == artifacts
+
+    r = run_check(state_path)  # DONE -> loads again
+    assert r.returncode == 0
+    assert load_state(state_path)["artifacts"] == artifacts
+
+    print("test_large_state_file_loads: OK")
 
 
 def test_no_state_does_nothing():
     """No state file -> check exits 0, does nothing."""
-    with tempfile.TemporaryDirectory() as tmp:
-        state_path = Path(tmp) / "nonexistent.json"
-        r = run_check(state_path)
-        assert r.returncode == 0
+    tmp = _test_dir("test_no_state_does_nothing")
+    state_path = tmp / "nonexistent.json"
+    r = run_check(state_path)
+    assert r.returncode == 0
 
     print("test_no_state_does_nothing: OK")
 
 
 def test_step_agent_cmd_blocked():
     """STEP_AGENT_CMD=bash -c is rejected (command injection prevention)."""
-    with tempfile.TemporaryDirectory() as tmp:
-        state_path = Path(tmp) / "state.json"
-        state = {
-            "plan": {"steps": {"step-1": {"title": "X", "instruction": "hello"}}},
-            "stepQueue": ["step-1"],
-            "currentStep": 0,
-            "stepRuns": {},
-            "stepDelayMinutes": 0,
-            "status": "IN_PROGRESS",
-        }
-        with open(state_path, "w") as f:
-            json.dump(state, f, indent=2)
-
-        env = os.environ.copy()
-        env["STEP_AGENT_CMD"] = "bash -c"
-
-        r = subprocess.run(
-            [sys.executable, str(RUNNER), str(state_path)],
-            cwd=tmp,
-            env=env,
-            capture_output=True,
-            text=True,
-        )
-        assert r.returncode == 2
-        assert "bash" in r.stderr or "shell" in r.stderr.lower()
+    tmp = _test_dir("test_step_agent_cmd_blocked")
+    state_path = tmp / "state.json"
+    state_path.write_bytes(_HELLO_STEP_STATE)
+
+    env = {**_BASE_ENV, "STEP_AGENT_CMD": "bash -c"}
+
+    r = subprocess.run(
+        [sys.executable, str(RUNNER), str(state_path)],
+        cwd=tmp,
+        env=env,
+        capture_output=True,
+        text=True,
+    )
+    assert r.returncode == 2
+    assert "bash" in r.stderr or "shell" in r.stderr.lower()
 
     print("test_step_agent_cmd_blocked: OK")
 
 
-def run_runner(state_path: Path, env: dict | None = None) -> subprocess.CompletedProcess:
-    env = env or os.environ.copy()
+def run_runner(state_path: Path, env: dict | None = None, capture: bool = False) -> subprocess.CompletedProcess:
+    env = env if env is not None else _BASE_ENV
     return subprocess.run(
         [sys.executable, str(RUNNER), str(state_path)],
         cwd=state_path.parent,
         env=env,
-        capture_output=True,
-        text=True,
+        **_output_kwargs(capture),
     )
 
 
 def test_required_outputs_missing_fails():
     """Agent exits 0 but requiredOutputs files missing -> step FAILED."""
-    with tempfile.TemporaryDirectory() as tmp:
-        state_path = Path(tmp) / "state.json"
-        state = {
-            "plan": {
-                "steps": {
-                    "step-1": {
-                        "title": "Produce file",
-                        "instruction": "write out",
-                        "requiredOutputs": ["out.md"],
-                    }
+    tmp = _test_dir("test_required_outputs_missing_fails")
+    state_path = tmp / "state.json"
+    state = {
+        "plan": {
+            "steps": {
+                "step-1": {
+                    "title": "Produce file",
+                    "instruction": "write out",
+                    "requiredOutputs": ["out.md"],
                 }
-            },
-            "stepQueue": ["step-1"],
-            "currentStep": 0,
-            "stepRuns": {},
-            "stepDelayMinutes": 0,
-            "status": "IN_PROGRESS",
-        }
-        with open(state_path, "w") as f:
-            json.dump(state, f, indent=2)
-
-        env = os.environ.copy()
-        env["STEP_AGENT_CMD"] = "echo"  # exits 0 but no out.md
-
-        run_runner(state_path, env)
-        s = load_state(state_path)
-        assert s["stepRuns"]["step-1"]["status"] == "FAILED"
-        assert "Missing required outputs" in s["stepRuns"]["step-1"].get("error", "")
+            }
+        },
+        "stepQueue": ["step-1"],
+        "currentStep": 0,
+        "stepRuns": {},
+        "stepDelayMinutes": 0,
+        "status": "IN_PROGRESS",
+    }
+    state_path.write_bytes(_serialize(state))
+
+    env = {**_BASE_ENV, "STEP_AGENT_CMD": "echo"}  # exits 0 but no out.md
+
+    run_runner(state_path, env)
+    s = load_state(state_path)
+    assert s["stepRuns"]["step-1"]["status"] == "FAILED"
+    assert "Missing required outputs" in s["stepRuns"]["step-1"].get("error", "")
 
     print("test_required_outputs_missing_fails: OK")
 
 
 def test_required_outputs_present_succeeds():
     """Agent exits 0 and requiredOutputs exist -> step DONE."""
-    with tempfile.TemporaryDirectory() as tmp:
-        state_path = Path(tmp) / "state.json"
-        (Path(tmp) / "artifacts").mkdir(exist_ok=True)
-        (Path(tmp) / "artifacts" / "report.md").write_text("done")
-        state = {
-            "plan": {
-                "steps": {
-                    "step-1": {
-                        "title": "Produce report",
-                        "instruction": "write report",
-                        "requiredOutputs": ["artifacts/report.md"],
-                    }
+    tmp = _test_dir("test_required_outputs_present_succeeds")
+    state_path = tmp / "state.json"
+    (tmp / "artifacts").mkdir(exist_ok=True)
+    (tmp / "artifacts" / "report.md").write_text("done")
+    state = {
+        "plan": {
+            "steps": {
+                "step-1": {
+                    "title": "Produce report",
+                    "instruction": "write report",
+                    "requiredOutputs": ["artifacts/report.md"],
                 }
-            },
-            "stepQueue": ["step-1"],
-            "currentStep": 0,
-            "stepRuns": {},
-            "stepDelayMinutes": 0,
-            "status": "IN_PROGRESS",
-        }
-        with open(state_path, "w") as f:
-            json.dump(state, f, indent=2)
-
-        env = os.environ.copy()
-        env["STEP_AGENT_CMD"] = "echo"
-
-        run_runner(state_path, env)
-        s = load_state(state_path)
-        assert s["stepRuns"]["step-1"]["status"] == "DONE"
+            }
+        },
+        "stepQueue": ["step-1"],
+        "currentStep": 0,
+        "stepRuns": {},
+        "stepDelayMinutes": 0,
+        "status": "IN_PROGRESS",
+    }
+    state_path.write_bytes(_serialize(state))
+
+    env = {**_BASE_ENV, "STEP_AGENT_CMD": "echo"}
+
+    run_runner(state_path, env)
+    s = load_state(state_path)
+    assert s["stepRuns"]["step-1"]["status"] == "DONE"
 
     print("test_required_outputs_present_succeeds: OK")
 
 
 def test_done_state_does_nothing():
-    """status=DONE -> check does nothing."""
-    with tempfile.TemporaryDirectory() as tmp:
-        state_path = Path(tmp) / "state.json"
-        state = {
-            "plan": {"steps": {}},
-            "stepQueue": [],
-            "currentStep": 0,
-            "stepRuns": {},
-            "status": "DONE",
-        }
-        with open(state_path, "w") as f:
-            json.dump(state, f, indent=2)
+    """status=DONE -> check does nothing; state.json is not rewritten, heartbeat goes to the sidecar."""
+    tmp = _test_dir("test_done_state_does_nothing")
+    state_path = tmp / "state.json"
+    state_path.write_bytes(_DONE_STATE)
 
-        run_check(state_path)
-        s = load_state(state_path)
-        assert s["status"] == "DONE"
+    run_check(state_path)
+    assert state_path.read_bytes() == _DONE_STATE
+    assert state_path.with_suffix(".heartbeat").read_text().strip()
+    s = load_state(state_path)
+    assert s["status"] == "DONE"
 
     print("test_done_state_does_nothing: OK")
 
 
+def test_heartbeat_debounced():
+    """PENDING step, no runner -> heartbeat goes to sidecar, rewritten at most once per debounce window."""
+    tmp = _test_dir("test_heartbeat_debounced")
+    state_path = tmp / "state.json"
+    state_path.write_bytes(_HELLO_STEP_STATE)
+    before = state_path.read_bytes()
+
+    env = {
+        **_BASE_ENV,
+        "STEP_RUNNER": str(tmp / "no-runner.py"),
+        "STEP_HEARTBEAT_DEBOUNCE_SEC": "60",
+    }
+
+    hb_path = state_path.with_suffix(".heartbeat")
+    run_check(state_path, env)
+    first = hb_path.stat().st_mtime_ns
+    run_check(state_path, env)
+    assert hb_path.stat().st_mtime_ns == first
+    assert state_path.read_bytes() == before
+
+    env["STEP_HEARTBEAT_DEBOUNCE_SEC"] = "0"
+    run_check(state_path, env)
+    assert hb_path.stat().st_mtime_ns != first
+
+    print("test_heartbeat_debounced: OK")
+
+
 def test_step_agent_cmd_unset():
     """STEP_AGENT_CMD unset -> runner exits 2 with clear error."""
-    with tempfile.TemporaryDirectory() as tmp:
-        state_path = Path(tmp) / "state.json"
-        state = {
-            "plan": {"steps": {"step-1": {"title": "X", "instruction": "hello"}}},
-            "stepQueue": ["step-1"],
-            "currentStep": 0,
-            "stepRuns": {},
-            "stepDelayMinutes": 0,
-            "status": "IN_PROGRESS",
-        }
-        with open(state_path, "w") as f:
-            json.dump(state, f, indent=2)
-
-        env = os.environ.copy()
-        env.pop("STEP_AGENT_CMD", None)
-
-        r = subprocess.run(
-            [sys.executable, str(RUNNER), str(state_path)],
-            cwd=tmp,
-            env=env,
-            capture_output=True,
-            text=True,
-        )
-        assert r.returncode == 2, f"Expected exit 2, got {r.returncode}"
-        assert "STEP_AGENT_CMD" in r.stderr
+    tmp = _test_dir("test_step_agent_cmd_unset")
+    state_path = tmp / "state.json"
+    state_path.write_bytes(_HELLO_STEP_STATE)
+
+    env = {k: v for k, v in _BASE_ENV.items() if k != "STEP_AGENT_CMD"}
+
+    r = subprocess.run(
+        [sys.executable, str(RUNNER), str(state_path)],
+        cwd=tmp,
+        env=env,
+        capture_output=True,
+        text=True,
+    )
+    assert r.returncode == 2, f"Expected exit 2, got {r.returncode}"
+    assert "STEP_AGENT_CMD" in r.stderr
 
     print("test_step_agent_cmd_unset: OK")
 
 
 def test_step_agent_cmd_binary_not_found():
     """STEP_AGENT_CMD points to nonexistent binary -> runner exits 2."""
-    with tempfile.TemporaryDirectory() as tmp:
-        state_path = Path(tmp) / "state.json"
-        state = {
-            "plan": {"steps": {"step-1": {"title": "X", "instruction": "hello"}}},
-            "stepQueue": ["step-1"],
-            "currentStep": 0,
-            "stepRuns": {},
-            "stepDelayMinutes": 0,
-            "status": "IN_PROGRESS",
-        }
-        with open(state_path, "w") as f:
-            json.dump(state, f, indent=2)
-
-        env = os.environ.copy()
-        env["STEP_AGENT_CMD"] = "nonexistent-binary-xyz --message"
-
-        r = subprocess.run(
-            [sys.executable, str(RUNNER), str(state_path)],
-            cwd=tmp,
-            env=env,
-            capture_output=True,
-            text=True,
-        )
-        assert r.returncode == 2, f"Expected exit 2, got {r.returncode}"
-        assert "not found on PATH" in r.stderr
+    tmp = _test_dir("test_step_agent_cmd_binary_not_found")
+    state_path = tmp / "state.json"
+    state_path.write_bytes(_HELLO_STEP_STATE)
+
+    env = {**_BASE_ENV, "STEP_AGENT_CMD": "nonexistent-binary-xyz --message"}
+
+    r = subprocess.run(
+        [sys.executable, str(RUNNER), str(state_path)],
+        cwd=tmp,
+        env=env,
+        capture_output=True,
+        text=True,
+    )
+    assert r.returncode == 2, f"Expected exit 2, got {r.returncode}"
+    assert "not found on PATH" in r.stderr
 
     print("test_step_agent_cmd_binary_not_found: OK")
 
 
 def test_stdout_captured_on_success():
     """Agent stdout is stored in stepRuns on success."""
-    with tempfile.TemporaryDirectory() as tmp:
-        state_path = Path(tmp) / "state.json"
-        state = {
-            "plan": {"steps": {"step-1": {"title": "Echo", "instruction": "hello world"}}},
-            "stepQueue": ["step-1"],
-            "currentStep": 0,
-            "stepRuns": {},
-            "stepDelayMinutes": 0,
-            "status": "IN_PROGRESS",
-        }
-        with open(state_path, "w") as f:
-            json.dump(state, f, indent=2)
+    tmp = _test_dir("test_stdout_captured_on_success")
+    state_path = tmp / "state.json"
+    state = {
+        "plan": {"steps": {"step-1": {"title": "Echo", "instruction": "hello world"}}},
+        "stepQueue": ["step-1"],
+        "currentStep": 0,
+        "stepRuns": {},
+        "stepDelayMinutes": 0,
+        "status": "IN_PROGRESS",
+    }
+    state_path.write_bytes(_serialize(state))
+
+    env = {**_BASE_ENV, "STEP_AGENT_CMD": "echo"}
+
+    run_runner(state_path, env)
+    s = load_state(state_path)
+    assert s["stepRuns"]["step-1"]["status"] == "DONE"
+    assert "stdout" in s["stepRuns"]["step-1"]
+    assert "hello world" in s["stepRuns"]["step-1"]["stdout"]
 
-        env = os.environ.copy()
-        env["STEP_AGENT_CMD"] = "echo"
+    print("test_stdout_captured_on_success: OK")
 
-        run_runner(state_path, env)
-        s = load_state(state_path)
-        assert s["stepRuns"]["step-1"]["status"] == "DONE"
-        assert "stdout" in s["stepRuns"]["step-1"]
-        assert "hello world" in s["stepRuns"]["step-1"]["stdout"]
 
-    print("test_stdout_captured_on_success: OK")
+def _run_one(name: str) -> tuple[str, str | None]:
+    """Run a test by name. Returns (name, None) on success, else (name, error message)."""
+    try:
+        globals()[name]()
+    except Exception as e:
+        return name, str(e)
+    return name, None
 
 
 def main():
@@ -399,21 +608,35 @@ def main():
         test_step_agent_cmd_unset,
         test_step_agent_cmd_binary_not_found,
         test_done_state_does_nothing,
+        test_heartbeat_debounced,
         test_basic_flow_two_steps,
+        test_runner_daemon_mode,
+        test_custom_runner_runs_as_subprocess,
         test_failure_marks_failed,
         test_retry_stops_at_max_retries,
         test_recovery_mid_flow,
+        test_recovery_skips_consecutive_done_steps,
+        test_save_keeps_state_file_mode,
+        test_save_follows_symlinked_state,
+        test_large_state_file_loads,
         test_required_outputs_missing_fails,
         test_required_outputs_present_succeeds,
         test_stdout_captured_on_success,
     ]
-    failed = []
-    for t in tests:
-        try:
-            t()
-        except Exception as e:
-            failed.append((t.__name__, e))
-            print(f"{t.__name__}: FAIL - {e}")
+    names = [t.__name__ for t in tests]
+    root = _shared_tmp()  # created here so the parent cleans it up; workers reuse it
+    if os.environ.get("STEP_SERIAL_TESTS") == "1":
+        results = [_run_one(name) for name in names]
+    else:
+        # Tests are independent and dominated by subprocess latency: run them concurrently
+        with ProcessPoolExecutor(
+            max_workers=len(names), initializer=_init_worker, initargs=(str(root),)
+        ) as executor:
+            futures = [executor.submit(_run_one, name) for name in names]
+            results = [f.result() for f in as_completed(futures)]
+    failed = [(name, error) for name, error in results if error is not None]
+    for name, error in failed:
+        print(f"{name}: FAIL - {error}")
 
     if failed:
         print(f"\n{len(failed)}/{len(tests)} tests failed")